@@ -22,21 +22,45 @@
 
 import sys
 import os
+import io
+import keyword
+import ast
 import traceback
-import CyberiadaML
+
+import importlib
+
+import graphml
 
 GLOBAL_INIT_LABEL = 'global initialization'
 SM_CONSTRUCTOR = 'sm constructor arguments'
 LOOP = 'loop'
 INIT_SCRIPTS = 'init scripts'
 
-HEADER_TEMPLATE = 'templates/header.templ'
-FOOTER_TEMPLATE = 'templates/footer.templ'
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+HEADER_TEMPLATE = os.path.join(TEMPLATES_DIR, 'header.templ')
+TYPED_HEADER_TEMPLATE = os.path.join(TEMPLATES_DIR, 'header_typed.templ')
+FOOTER_TEMPLATE = os.path.join(TEMPLATES_DIR, 'footer.templ')
 TICK_EVENT = 'TIME_TICK'
+OFFLOAD_MARKER = '#offload'
+OFFLOAD_WORKERS = 4
 STANDARD_EVENTS = {TICK_EVENT: 'Tick',
                    'TIME_TICK_1S': 'Tick1Sec',
                    'INIT': 'Init'}
 
+FRONTEND_NATIVE = 'native'
+FRONTEND_STREAM = 'stream'
+GRAPH_FORMATS = {'detect': 'formatDetect',
+                 'cyberiada': 'formatCyberiada10',
+                 'yed': 'formatLegacyYED'}
+
+PACKAGE_INIT = '__init__.py'
+PACKAGE_MAIN = '__main__.py'
+# the names bound by the templates and the generated module globals
+RESERVED_NAMES = ('__init__', '__main__', 'sys', 'time', 'pysm', 'concurrent', 'TICK_LEN', 'OFFLOAD_WORKERS',
+                  'MACHINES', 'DISPATCH', 'DISPATCH_SM', 'DISPATCH_VALUE',
+                  'Any', 'Callable', 'Dict', 'List', 'Optional', 'Union')
+CODE_ENCODING = 'utf-8'
+
 def DEBUG(*args):
     sys.stderr.write(' '.join(map(str, args)) + '\n')
 
@@ -53,27 +77,179 @@ class GeneratorError(ConvertorError):
     def __init__(self, msg):
         ConvertorError.__init__(self, msg)
 
+_native_frontend = {}
+
+def load_native_frontend():
+    # the native binding is imported on the first use,
+    # the stream frontend does not pay for its start-up
+    if 'ml' not in _native_frontend:
+        try:
+            _native_frontend['ml'] = importlib.import_module('CyberiadaML')
+        except ImportError:
+            _native_frontend['ml'] = None
+    return _native_frontend['ml']
+
+def frontend_exceptions(ml):
+    # the exceptions of the native binding to be reported as parser errors
+    if ml is None or ml is graphml:
+        return ()
+    return (ml.Exception,)
+
+def open_document(graph_file, frontend=None, graph_format='detect'):
+    if frontend is None:
+        frontend = FRONTEND_NATIVE if load_native_frontend() is not None else FRONTEND_STREAM
+    if frontend == FRONTEND_NATIVE:
+        ml = load_native_frontend()
+        if ml is None:
+            raise ParserError('The native CyberiadaML frontend is not available!\n')
+    elif frontend == FRONTEND_STREAM:
+        ml = graphml
+    else:
+        raise ParserError('Unknown graph frontend {}!\n'.format(frontend))
+    if graph_format not in GRAPH_FORMATS:
+        raise ParserError('Unknown graph format {}!\n'.format(graph_format))
+    try:
+        doc = ml.LocalDocument()
+        doc.open(graph_file, getattr(ml, GRAPH_FORMATS[graph_format]), ml.geometryFormatNone,
+                 False, False, True)
+    except graphml.GraphmlError as e:
+        raise ParserError('Graphml reading error: {}\n'.format(e)) from e
+    except frontend_exceptions(ml) as e:
+        raise ParserError('Unexpected CyberiadaML exception: {}\n{}\n'.format(e.__class__,
+                                                                              traceback.format_exc())) from e
+    return ml, doc
+
+_templates = {}
+
+def load_template(filename):
+    # the templates are read once per process
+    if filename not in _templates:
+        with open(filename, encoding=CODE_ENCODING) as f:
+            _templates[filename] = f.read()
+    return _templates[filename]
+
+def is_binary_sink(target):
+    if isinstance(target, (io.RawIOBase, io.BufferedIOBase)):
+        return True
+    if isinstance(target, io.TextIOBase):
+        return False
+    # wrappers (tempfile, codecs) are checked by the mode
+    return 'b' in getattr(target, 'mode', '')
+
+def write_code(code, target=None):
+    # the code is written to the sink at once: stdout, a file path or
+    # a file-like object (text or binary)
+    if target is None:
+        sys.stdout.write(code)
+    elif hasattr(target, 'write'):
+        if is_binary_sink(target):
+            target.write(code.encode(CODE_ENCODING))
+        else:
+            target.write(code)
+    else:
+        with open(target, 'w', encoding=CODE_ENCODING) as f:
+            f.write(code)
+
+class CodeBuilder:
+    # collects the generated code chunks in one buffer,
+    # the indentation prefixes are shared between the lines
+    INDENTS = [' ' * 4 * level for level in range(8)]
+
+    def __init__(self):
+        self.__chunks = []
+        # the writers push the chunks by the bound list method directly
+        self.append = self.__chunks.append
+
+    def write(self, s, level=0):
+        if level:
+            self.append(self.INDENTS[level])
+        self.append(s)
+
+    def getvalue(self, encoding=None):
+        code = ''.join(self.__chunks)
+        if encoding is not None:
+            return code.encode(encoding)
+        return code
+
+INDENT4 = CodeBuilder.INDENTS[1]
+INDENT8 = CodeBuilder.INDENTS[2]
+
+# the fixed method bodies depend only on the attributes prefix,
+# they are rendered once per prefix
+CODE_BLOCKS = {
+    'init_tick': ('# Tick events constants & variables\n',
+                  'self.{p}time = self.{p}prev_time = self.{p}tick = self.{p}tick_1s = 0.0\n',
+                  'self.{p}tick_len = TICK_LEN / 1000.0\n'),
+    'dispatch_tick': ('# Check tick events\n',
+                      'self.{p}time = time.time()\n',
+                      'timedelta = self.{p}time - self.{p}prev_time\n',
+                      'self.{p}prev_time = self.{p}time\n',
+                      'self.{p}tick += timedelta\n',
+                      'self.{p}tick_1s += timedelta\n',
+                      'if self.{p}tick >= self.{p}tick_len:\n',
+                      '    while self.{p}tick >= self.{p}tick_len:\n',
+                      '        self.{p}tick -= self.{p}tick_len\n',
+                      '    self.{p}sm.dispatch(self.TickEvent)\n',
+                      'if self.{p}tick_1s >= 1.0:\n',
+                      '    while self.{p}tick_1s >= 1.0:\n',
+                      '        self.{p}tick_1s -= 1.0\n',
+                      '    self.{p}sm.dispatch(self.Tick1SecEvent)\n'),
+    'dispatch': ('if eventstr is not None and eventstr in self.{p}events:\n',
+                 '    if arg is None:\n',
+                 '        self.{p}sm.dispatch(self.{p}events[eventstr])\n',
+                 '    else:\n',
+                 '        args = {{"value": arg}}\n',
+                 '        self.{p}sm.dispatch(pysm.Event(eventstr, **args))\n',
+                 'while self.{p}event_queue:\n',
+                 '    eventstr = self.{p}event_queue.pop(0)\n',
+                 '    if eventstr in self.{p}events:\n',
+                 '        self.{p}sm.dispatch(self.{p}events[eventstr])\n'),
+    'offload': ('future = self.{p}executor.submit(action, *args)\n',
+                'future.add_done_callback(lambda fut: self.{p}offload_done(fut, done_event, error_event))\n')
+}
+
+_blocks = {}
+
 class CodeGenerator:
 
     VERSION = '1.0' # generator version
 
     def __init__(self, graph_file, **kwargs):
+        self.__reset_handlers()
         self.__load_graph(graph_file, **kwargs)
 
+    def __reset_handlers(self):
+        # the handlers state of a single generate() run
+        self.__handlers = {}
+        self.__handler_refs = {}
+        self.__method_bodies = {}
+        self.__constant_guards = {}
+        self.__state_names = {}
+
     def __load_graph(self, graph_file, **kwargs):
+        self.__ml = None
         try:
             self.__graph_file = graph_file
             self.__exit_on_term = kwargs['exit_on_term'] if 'exit_on_term' in kwargs else False
             self.__allow_empty_trans = kwargs['allow_empty_trans'] if 'allow_empty_trans' in kwargs else False
             self.__generate_loop = kwargs['generate_loop'] if 'generate_loop' in kwargs else False
             self.__use_ticks = kwargs['use_ticks'] if 'use_ticks' in kwargs else True
+            self.__optimize = kwargs['optimize'] if 'optimize' in kwargs else False
+            self.__typed = kwargs['typed'] if 'typed' in kwargs else False
+            # the typed code uses protected attributes instead of the name mangling
+            self.__prefix = '_' if self.__typed else '__'
             if not self.__use_ticks and (self.__generate_loop or self.__allow_empty_trans):
                 self.__use_ticks = True
-
-            self.__doc = CyberiadaML.LocalDocument()
-            self.__doc.open(graph_file, CyberiadaML.formatDetect, CyberiadaML.geometryFormatNone,
-                            False, False, True)
-            self.__graph = self.__doc.get_state_machines()[0]
+            self.__package = kwargs['package'] if 'package' in kwargs else False
+            if 'document' in kwargs:
+                # the document is already parsed by DocumentGenerator
+                self.__ml, self.__doc = kwargs['document']
+            else:
+                self.__ml, self.__doc = open_document(graph_file,
+                                                      kwargs['frontend'] if 'frontend' in kwargs else None,
+                                                      kwargs['graph_format'] if 'graph_format' in kwargs else 'detect')
+            sm_index = kwargs['state_machine'] if 'state_machine' in kwargs else 0
+            self.__graph = self.__doc.get_state_machines()[sm_index]
 
             self.__sm_name = self.__graph.get_name()
             self.__sm_name_cap = self.__sm_name[0].upper() + self.__sm_name[1:].lower()
@@ -89,7 +265,7 @@ class CodeGenerator:
                 INIT_SCRIPTS: self.__init_scripts
             }
 
-            for comment in self.__graph.find_elements_by_type(CyberiadaML.elementComment):
+            for comment in self.__graph.find_elements_by_type(self.__ml.elementComment):
                 text = comment.get_body()
                 for label, var in comment_labels.items():
                     if text.lower().find(label) == 0:
@@ -110,8 +286,9 @@ class CodeGenerator:
             init_id = None
             self.__initial = None
             self.__initial_behavior = None
+            self.__offload_actions = False
             for state in self.__graph.get_children():
-                if state.get_type() == CyberiadaML.elementInitial:
+                if state.get_type() == self.__ml.elementInitial:
                     if init_id is not None:
                         raise ParserError('The graph {} has more than one initial'.format(self.__graph_file) +
                                           'pseudostate on the top level!\n')
@@ -121,24 +298,24 @@ class CodeGenerator:
             uniq_states = set([])
 
             self.__signals = {}
-            self.__handlers = {}
             self.__transitions = []
             self.__local_transitions = []
-            self.__final_states = len(self.__graph.find_elements_by_type(CyberiadaML.elementFinal)) > 0
+            self.__final_states = len(self.__graph.find_elements_by_type(self.__ml.elementFinal)) > 0
 
-            types = [CyberiadaML.elementTransition,
-                     CyberiadaML.elementSimpleState,
-                     CyberiadaML.elementCompositeState]
+            types = [self.__ml.elementTransition,
+                     self.__ml.elementSimpleState,
+                     self.__ml.elementCompositeState]
             for element in self.__graph.find_elements_by_types(types):
-                if element.get_type() == CyberiadaML.elementTransition:
+                if element.get_type() == self.__ml.elementTransition:
                     source_id = element.get_source_element_id()
                     if source_id == init_id:
                         target_id = element.get_target_element_id()
                         self.__initial = self.__graph.find_element_by_id(target_id)
                         self.__initial_behavior = element.get_action().get_behavior()
+                        self.__check_trigger_and_behavior(element.get_id(), None, None, self.__initial_behavior)
                         continue
                     source_state = self.__graph.find_element_by_id(source_id)
-                    if source_state.get_type() == CyberiadaML.elementInitial:
+                    if source_state.get_type() == self.__ml.elementInitial:
                         continue
                     a = element.get_action()
                     if len(a.get_trigger()) == 0 and not self.__allow_empty_trans:
@@ -164,7 +341,7 @@ class CodeGenerator:
                                                                                                                  full_name))
                     uniq_states.add(full_name)
                     for a in element.get_actions():
-                        if a.get_type() == CyberiadaML.actionTransition:
+                        if a.get_type() == self.__ml.actionTransition:
                             if len(a.get_trigger()) == 0:
                                 raise ParserError('The graph {} has state {} with empty trigger in int.trans.!\n'.format(self.__graph_file,
                                                                                                                          element.get_id()))
@@ -178,9 +355,9 @@ class CodeGenerator:
 
             self.__initial_states = {}
             # init_parent = self.__initial.get_parent()
-            # if init_parent.get_type() != CyberiadaML.elementSM:
+            # if init_parent.get_type() != self.__ml.elementSM:
             #     self.__initial_states[init_parent.get_id()] = self.__initial.get_id()
-            for element in self.__graph.find_elements_by_type(CyberiadaML.elementInitial):
+            for element in self.__graph.find_elements_by_type(self.__ml.elementInitial):
                 if element.get_id() in self.__initial_states:
                     continue
                 for t in self.__transitions:
@@ -188,7 +365,7 @@ class CodeGenerator:
                         parent = element.get_parent()
                         self.__initial_states[parent.get_id()] = element.get_target_element_id()
                         break
-            for element in self.__graph.find_elements_by_type(CyberiadaML.elementCompositeState):
+            for element in self.__graph.find_elements_by_type(self.__ml.elementCompositeState):
                 if element.get_id() in self.__initial_states:
                     continue
                 self.__initial_states[element.get_id()] = element.get_children()[0].get_id()
@@ -199,27 +376,65 @@ class CodeGenerator:
             for s, v in STANDARD_EVENTS.items():
                 self.__signals[s] = 'self.' + v
 
-        except CyberiadaML.Exception as e:
+        except graphml.GraphmlError as e:
+            raise ParserError('Graphml reading error: {}\n'.format(e)) from e
+        except frontend_exceptions(self.__ml) as e:
             raise ParserError('Unexpected CyberiadaML exception: {}\n{}\n'.format(e.__class__,
-                                                                                  traceback.format_exc()))
-    def __check_trigger_and_behavior(self, context, trigger, guard, behavior):
-        pass
+                                                                                  traceback.format_exc())) from e
+
+    def get_sm_name(self):
+        return self.__sm_name
+
+    def get_sm_class(self):
+        return self.__sm_name_cap
+
+    def __check_trigger_and_behavior(self, _context, _trigger, _guard, behavior):
+        if behavior and self.__parse_offload(behavior) is not None:
+            self.__offload_actions = True
 
     @classmethod
-    def __w(cls, f, s):
-        f.write(s)
-    @classmethod
-    def __w4(cls, f, s):
-        f.write(' ' * 4 + s)
-    @classmethod
-    def __w8(cls, f, s):
-        f.write(' ' * 8 + s)
+    def __parse_offload(cls, behavior):
+        lines = behavior.split('\n')
+        words = lines[0].split()
+        if not words or words[0] != OFFLOAD_MARKER:
+            return None
+        if len(words) > 3:
+            raise ParserError('Too many events in the offload marker "{}"!\n'.format(lines[0].strip()))
+        events = words[1:] + [None] * (3 - len(words))
+        return events[0], events[1], '\n'.join(lines[1:])
+
+    def __w(self, f, s):
+        f.append(s)
+    def __write_block(self, f, name):
+        key = (name, self.__prefix)
+        if key not in _blocks:
+            _blocks[key] = ''.join(INDENT8 + line.format(p=self.__prefix) for line in CODE_BLOCKS[name])
+        f.append(_blocks[key])
+    def __w4(self, f, s):
+        append = f.append
+        append(INDENT4)
+        append(s)
+    def __w8(self, f, s):
+        append = f.append
+        append(INDENT8)
+        append(s)
 
     @classmethod
     def __insert_file(cls, f, filename):
-        with open(filename) as input_file:
-            for line in input_file.readlines():
-                cls.__w(f, line)
+        with open(filename, encoding=CODE_ENCODING) as input_file:
+            f.write(input_file.read())
+
+    @classmethod
+    def __insert_template(cls, f, filename):
+        f.write(load_template(filename))
+
+    def __write_def(self, f, name, args, typed_args, returns):
+        if self.__typed:
+            if name.startswith('__') and not name.endswith('__'):
+                name = name[1:]
+            self.__w4(f, 'def {}({}) -> {}:\n'.format(name, typed_args, returns))
+        else:
+            self.__w4(f, 'def {}({}):\n'.format(name, args))
 
     def __write_technical_info(self, f):
         self.__w(f, '# The SM class {} based on {} file\n'.format(self.__sm_name_cap, self.__graph_file))
@@ -232,23 +447,58 @@ class CodeGenerator:
 
     def __write_class(self, f):
         self.__w(f, '\nclass {}:\n'.format(self.__sm_name_cap))
+        if self.__typed:
+            self.__write_slots(f)
+
+    def __typed_attributes(self):
+        attributes = [(var, 'Any') for var in sorted(self.__sm_variables)]
+        attributes += [('_sm', 'pysm.StateMachine'),
+                       ('_terminated', 'bool')]
+        if self.__use_ticks:
+            attributes += [(a, 'float') for a in ('_time', '_prev_time', '_tick', '_tick_1s', '_tick_len')]
+            if self.__generate_loop:
+                attributes.append(('_sleep_len', 'float'))
+        if self.__offload_actions:
+            attributes.append(('_executor', 'concurrent.futures.ThreadPoolExecutor'))
+        attributes += [('_event_queue', 'List[str]'),
+                       ('_events', 'Dict[str, pysm.Event]')]
+        for v in STANDARD_EVENTS.values():
+            attributes += [(v, 'str'), (v + 'Event', 'pysm.Event')]
+        return attributes
+
+    def __write_slots(self, f):
+        attributes = self.__typed_attributes()
+        self.__w(f, '\n')
+        self.__w4(f, '__slots__ = ({},)\n'.format(', '.join(map(lambda a: '"{}"'.format(a[0]), attributes))))
+        self.__w(f, '\n')
+        for name, attr_type in attributes:
+            self.__w4(f, '{}: {}\n'.format(name, attr_type))
 
     def __write_constructor(self, f):
         var_pairs = map(lambda i: '{}={}'.format(*i),
                         sorted(self.__sm_variables.items(), key=lambda x: x[0]))
+        typed_pairs = map(lambda i: ', {}: Any = {}'.format(*i),
+                          sorted(self.__sm_variables.items(), key=lambda x: x[0]))
         self.__w(f, '\n')
-        self.__w4(f, 'def __init__(self, {}):\n'.format(', '.join(var_pairs)))
+        self.__write_def(f, '__init__', 'self, {}'.format(', '.join(var_pairs)),
+                         'self' + ''.join(typed_pairs), 'None')
         for var in self.__sm_variables:
             self.__w8(f, 'self.{var} = {var}\n'.format(var=var))
-        self.__w8(f, 'self.__sm = pysm.StateMachine("{}")\n'.format(self.__sm_name))
-        self.__w8(f, 'self.__terminated = False')
+        self.__w8(f, 'self.{p}sm = pysm.StateMachine("{}")\n'.format(self.__sm_name, p=self.__prefix))
+        self.__w8(f, 'self.{p}terminated = False\n'.format(p=self.__prefix))
         if self.__use_ticks:
             self.__init_tick(f)
-        self.__w8(f, 'self.__event_queue = []')
+        if self.__offload_actions:
+            self.__w8(f, 'self.{p}executor = concurrent.futures.ThreadPoolExecutor(max_workers=OFFLOAD_WORKERS)\n'.format(p=self.__prefix))
+        self.__w8(f, 'self.{p}event_queue = []\n'.format(p=self.__prefix))
 
-    @classmethod
-    def __get_state_name(cls, state):
-        return state.get_qualified_name().replace('::', '_')
+    def __get_state_name(self, state):
+        # the names are resolved once per run, the states are referenced
+        # by the handlers, the guards and the transitions
+        state_id = state.get_id()
+        if state_id not in self.__state_names:
+            self.__state_names[state_id] = state.get_qualified_name().replace('::', '_')
+        return self.__state_names[state_id]
     @classmethod
     def __parse_trigger(cls, trigger):
         if trigger.find('(') > 0:
@@ -259,59 +509,149 @@ class CodeGenerator:
 
     def __write_entry_handler(self, f, state_name, entry, behavior):
         handler_name = 'on_st_{}_{}'.format(state_name, entry)
+        # self.__w4(f, 'def {}(self, state, event):\n'.format(handler_name))
+        handler = self.__write_behavior(f, handler_name, behavior, None)
+        if handler is None:
+            return
         if state_name not in self.__handlers:
             self.__handlers[state_name] = {}
         if entry not in self.__handlers[state_name]:
-            self.__handlers[state_name][entry] = 'self.' + handler_name
-        self.__w(f, '\n')
-        self.__w4(f, 'def {}(self, *_):\n'.format(handler_name))
-        # self.__w4(f, 'def {}(self, state, event):\n'.format(handler_name))
-        for line in behavior.split('\n'):
-            self.__w8(f, line + '\n')
+            self.__handlers[state_name][entry] = handler
 
     def __write_entries_recursively(self, f, state):
         for a in state.get_actions():
-            if a.get_type() == CyberiadaML.actionEntry:
+            if a.get_type() == self.__ml.actionEntry:
                 self.__write_entry_handler(f, self.__get_state_name(state), 'enter', a.get_behavior())
-            elif a.get_type() == CyberiadaML.actionExit:
+            elif a.get_type() == self.__ml.actionExit:
                 self.__write_entry_handler(f, self.__get_state_name(state), 'exit', a.get_behavior())
         for ch in state.get_children():
-            if ch.get_type() in (CyberiadaML.elementSimpleState, CyberiadaML.elementCompositeState):
+            if ch.get_type() in (self.__ml.elementSimpleState, self.__ml.elementCompositeState):
                 self.__write_entries_recursively(f, ch)
 
     def __write_entries(self, f):
         self.__w(f, '\n')
         self.__w4(f, '# Entry & Exit Handlers:\n')
         for ch in self.__graph.get_children():
-            if ch.get_type() in (CyberiadaML.elementSimpleState, CyberiadaML.elementCompositeState):
+            if ch.get_type() in (self.__ml.elementSimpleState, self.__ml.elementCompositeState):
                 self.__write_entries_recursively(f, ch)
 
     @classmethod
-    def __write_guard_handler(cls, f, trigger_name, condition, argument):
+    def __is_empty_body(cls, lines):
+        for line in lines:
+            line = line.strip()
+            if len(line) > 0 and line[0] != '#' and line != 'pass':
+                return False
+        return True
+
+    def __write_method(self, f, handler_name, lines, returns='None', handler=True, argument=None):
+        # writes the handler method and returns the reference to the handler
+        # to be used in the SM definition or None if the handler is not needed
+        if handler:
+            typed_args = 'self, state: pysm.State, event: pysm.Event'
+            # the trigger argument is taken from the event cargo
+            args = 'self, state, event' if argument else 'self, *_'
+        elif argument:
+            # the offloaded action gets the trigger argument from its handler
+            args, typed_args = 'self, {}'.format(argument), 'self, {}: Any'.format(argument)
+        else:
+            args, typed_args = 'self', 'self'
+        if self.__optimize:
+            if self.__is_empty_body(lines):
+                self.__handler_refs[handler_name] = None
+                return None
+            key = (args, returns, tuple(lines))
+            if key in self.__method_bodies:
+                self.__handler_refs[handler_name] = self.__method_bodies[key]
+                return self.__method_bodies[key]
+            self.__method_bodies[key] = 'self.' + handler_name
+        elif self.__is_empty_body(lines):
+            lines = lines + ['pass']
+        self.__handler_refs[handler_name] = 'self.' + handler_name
+        self.__w(f, '\n')
+        self.__write_def(f, handler_name, args, typed_args, returns)
+        for line in lines:
+            self.__w8(f, line + '\n')
+        return self.__handler_refs[handler_name]
+
+    def __handler_ref(self, handler_name):
+        return self.__handler_refs.get(handler_name)
+
+    @classmethod
+    def __constant_guard(cls, condition):
+        # pysm takes the transition only if the guard returns exactly True,
+        # so any other literal (1, "x", [1]) is a false guard
+        try:
+            return ast.literal_eval(condition.strip()) is True
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            return None
+
+    def __write_guard_handler(self, f, trigger_name, condition, argument):
         handler_name = "is_{}".format(trigger_name)
-        cls.__w(f, '\n')
-        # cls.__w4(f, "def {}(self, state, event):\n".format(handler_name))
-        cls.__w4(f, "def {}(self, *_):\n".format(handler_name))
+        if self.__optimize:
+            value = self.__constant_guard(condition)
+            if value is not None:
+                # the trivial guard is inlined: the condition is dropped or
+                # the transition is never generated
+                self.__handler_refs[handler_name] = None
+                self.__constant_guards[handler_name] = value
+                return
+        lines = []
         if argument:
-            cls.__w8(f, '{} = event.cargo["value"]\n'.format(argument))
-        cls.__w8(f, 'return ({})\n'.format(condition))
+            lines.append('{} = event.cargo["value"]'.format(argument))
+        if self.__typed:
+            lines.append('return ({}) is True'.format(condition))
+        else:
+            lines.append('return ({})'.format(condition))
+        self.__write_method(f, handler_name, lines, 'bool', argument=argument)
 
-    @classmethod
-    def __write_trigger_action(cls, f, trigger_name, behavior, argument):
+    def __write_trigger_action(self, f, trigger_name, behavior, argument):
         handler_name = "on_{}".format(trigger_name)
-        cls.__w(f, '\n')
-        # cls.__w4(f, 'def {}(self, state, event):\n'.format(handler_name))
-        cls.__w4(f, 'def {}(self, *_):\n'.format(handler_name))
+        if not self.__constant_guards.get('is_{}'.format(trigger_name), True):
+            # the transition is never taken
+            return
+        # self.__w4(f, 'def {}(self, state, event):\n'.format(handler_name))
+        self.__write_behavior(f, handler_name, behavior, argument)
+
+    def __write_behavior(self, f, handler_name, behavior, argument):
+        offload = self.__parse_offload(behavior)
+        lines = []
         if argument:
-            cls.__w8(f, '{} = event.cargo["value"]\n'.format(argument))
-        for line in behavior.split('\n'):
-            cls.__w8(f, line + '\n')
+            lines.append('{} = event.cargo["value"]'.format(argument))
+        if offload is None:
+            return self.__write_method(f, handler_name, lines + behavior.split('\n'), argument=argument)
+        # the behavior is executed by the worker pool, the handler only submits it
+        done_event, error_event, behavior = offload
+        action = self.__write_method(f, 'offloaded_{}'.format(handler_name), behavior.split('\n'),
+                                     handler=False, argument=argument)
+        if action is None:
+            # nothing to run in the pool, the action is completed at once
+            if done_event is not None:
+                lines.append('self.push_event("{}")'.format(done_event))
+        else:
+            args = [action] + ['"{}"'.format(e) if e is not None else 'None' for e in (done_event, error_event)]
+            if argument:
+                args.append(argument)
+            lines.append('self.{p}offload({})'.format(', '.join(args), p=self.__prefix))
+        return self.__write_method(f, handler_name, lines, argument=argument)
+
+    def __transition_parts(self, trigger_name):
+        # returns None when the transition is disabled by a constant guard
+        if not self.__constant_guards.get('is_{}'.format(trigger_name), True):
+            return None
+        parts = []
+        condition = self.__handler_ref('is_{}'.format(trigger_name))
+        if condition is not None:
+            parts.append('condition={}'.format(condition))
+        action = self.__handler_ref('on_{}'.format(trigger_name))
+        if action is not None:
+            parts.append('action={}'.format(action))
+        return parts
 
     def __write_guards_recursively(self, f, state):
         handlers = {}
         # internal triggers
         for a in state.get_actions():
-            if a.get_type() == CyberiadaML.actionTransition:
+            if a.get_type() == self.__ml.actionTransition:
                 name, argument = self.__parse_trigger(a.get_trigger())
                 trigger_name = '{}_{}'.format(self.__get_state_name(state), name)
                 if trigger_name not in handlers:
@@ -329,7 +669,7 @@ class CodeGenerator:
             if t.get_source_element_id() != state.get_id():
                 continue
             target = self.__graph.find_element_by_id(t.get_target_element_id())
-            if target.get_type() == CyberiadaML.elementFinal:
+            if target.get_type() == self.__ml.elementFinal:
                 target_name = 'terminate'
             else:
                 target_name = self.__get_state_name(target)
@@ -352,7 +692,7 @@ class CodeGenerator:
                 self.__write_trigger_action(f, trigger_name, a.get_behavior(), argument)
 
         for ch in state.get_children():
-            if ch.get_type() in (CyberiadaML.elementSimpleState, CyberiadaML.elementCompositeState):
+            if ch.get_type() in (self.__ml.elementSimpleState, self.__ml.elementCompositeState):
                 self.__write_guards_recursively(f, ch)
 
     def __write_guards(self, f):
@@ -361,7 +701,7 @@ class CodeGenerator:
         if self.__initial_behavior:
             self.__write_trigger_action(f, "initial", self.__initial_behavior, None)
         for ch in self.__graph.get_children():
-            if ch.get_type() in (CyberiadaML.elementSimpleState, CyberiadaML.elementCompositeState):
+            if ch.get_type() in (self.__ml.elementSimpleState, self.__ml.elementCompositeState):
                 self.__write_guards_recursively(f, ch)
 
     def __write_handlers(self, f, state_name):
@@ -375,19 +715,19 @@ class CodeGenerator:
         self.__w(f, '\n')
         self.__w8(f, '# Hierarchical States:\n')
         self.__w8(f, 'st_initial = pysm.State("initial")\n')
-        self.__w8(f, 'self.__sm.add_state(st_initial, initial=True)\n')
+        self.__w8(f, 'self.{p}sm.add_state(st_initial, initial=True)\n'.format(p=self.__prefix))
         if self.__final_states:
             self.__w8(f, 'st_terminate = pysm.State("terminate")\n')
-            self.__w8(f, 'self.__sm.add_state(st_terminate)\n')
+            self.__w8(f, 'self.{p}sm.add_state(st_terminate)\n'.format(p=self.__prefix))
             self.__w8(f, 'st_terminate.handlers = {"enter": self.terminate}\n')
         for ch in self.__graph.get_children():
-            if ch.get_type() in (CyberiadaML.elementSimpleState, CyberiadaML.elementCompositeState):
-                self.__write_states_recursively(f, ch, 'self.__sm', ch.get_id() == self.__initial.get_id())
+            if ch.get_type() in (self.__ml.elementSimpleState, self.__ml.elementCompositeState):
+                self.__write_states_recursively(f, ch, 'self.{p}sm'.format(p=self.__prefix), ch.get_id() == self.__initial.get_id())
 
     def __write_states_recursively(self, f, state, parent_var, initial):
         state_name = self.__get_state_name(state)
         state_var = 'st_{}'.format(state_name)
-        if state.get_type() == CyberiadaML.elementCompositeState:
+        if state.get_type() == self.__ml.elementCompositeState:
             sm_class = "StateMachine"
         else:
             sm_class = "State"
@@ -395,10 +735,10 @@ class CodeGenerator:
         self.__w8(f, '{}.add_state({}{})\n'.format(parent_var, state_var,
                                                    ', initial=True' if initial else ''))
         self.__write_handlers(f, state_name)
-        if state.get_type() == CyberiadaML.elementCompositeState:
+        if state.get_type() == self.__ml.elementCompositeState:
             initial_id = self.__initial_states[state.get_id()]
             for ch in state.get_children():
-                if ch.get_type() in (CyberiadaML.elementSimpleState, CyberiadaML.elementCompositeState):
+                if ch.get_type() in (self.__ml.elementSimpleState, self.__ml.elementCompositeState):
                     self.__write_states_recursively(f, ch, state_var, ch.get_id() == initial_id)
 
     def __write_events(self, f):
@@ -408,7 +748,7 @@ class CodeGenerator:
             self.__w8(f, '{} = "{}"\n'.format(v, s))
             self.__w8(f, '{ev}Event = pysm.Event({ev})\n'.format(ev=v))
         signals_str = map(lambda i: '"{}": {}Event'.format(*i), self.__signals.items())
-        self.__w8(f, 'self.__events = {{{}}}\n'.format(', '.join(signals_str)))
+        self.__w8(f, 'self.{p}events = {{{}}}\n'.format(', '.join(signals_str), p=self.__prefix))
 
     def __write_transitions(self, f):
         self.__w(f, '\n')
@@ -416,7 +756,7 @@ class CodeGenerator:
         for state in self.__local_transitions:
             handlers = {}
             for a in state.get_actions():
-                if a.get_type() == CyberiadaML.actionTransition:
+                if a.get_type() == self.__ml.actionTransition:
                     state_name = self.__get_state_name(state)
                     name, _ = self.__parse_trigger(a.get_trigger())
                     trigger_name = '{}_{}'.format(state_name, name)
@@ -425,16 +765,15 @@ class CodeGenerator:
                     else:
                         handlers[trigger_name] += 1
                         trigger_name += '_{}'.format(handlers[trigger_name])
+                    handler_parts = self.__transition_parts(trigger_name)
+                    if handler_parts is None:
+                        continue
                     parts = ['st_{}'.format(self.__get_state_name(state)),
                              'None',
-                             'events=[{}]'.format(self.__signals[name])]
-                    if a.has_guard():
-                        parts.append('condition=self.is_{}'.format(trigger_name))
-                    if a.has_behavior():
-                        parts.append('action=self.on_{}'.format(trigger_name))
+                             'events=[{}]'.format(self.__signals[name])] + handler_parts
                     parent = state.get_parent()
-                    if parent.get_type() == CyberiadaML.elementSM:
-                        owner = 'self.__sm'
+                    if parent.get_type() == self.__ml.elementSM:
+                        owner = 'self.{p}sm'.format(p=self.__prefix)
                     else:
                         owner = 'st_{}'.format(self.__get_state_name(parent))
                     self.__w8(f, '{}.add_transition({})\n'.format(owner, ', '.join(parts)))
@@ -444,9 +783,9 @@ class CodeGenerator:
         parts = ['st_initial',
                  'st_{}'.format(self.__get_state_name(self.__initial)),
                  'events=[self.Init]']
-        if self.__initial_behavior:
-            parts.append('action=self.on_initial')
-        self.__w8(f, 'self.__sm.add_transition({})\n'.format(', '.join(parts)))
+        if self.__handler_ref('on_initial') is not None:
+            parts.append('action={}'.format(self.__handler_ref('on_initial')))
+        self.__w8(f, 'self.{p}sm.add_transition({})\n'.format(', '.join(parts), p=self.__prefix))
 
         # external triggers
         handlers = {}
@@ -456,7 +795,7 @@ class CodeGenerator:
             if source_name not in handlers:
                 handlers[source_name] = {}
             target = self.__graph.find_element_by_id(t.get_target_element_id())
-            if target.get_type() == CyberiadaML.elementFinal:
+            if target.get_type() == self.__ml.elementFinal:
                 target_name = 'terminate'
             else:
                 target_name = self.__get_state_name(target)
@@ -473,92 +812,114 @@ class CodeGenerator:
             else:
                 handlers[trigger_name] += 1
                 trigger_name += '_{}'.format(handlers[trigger_name])
+            handler_parts = self.__transition_parts(trigger_name)
+            if handler_parts is None:
+                continue
             parts = ['st_{}'.format(source_name),
                      'st_{}'.format(target_name),
-                     'events=[{}]'.format(self.__signals[name])]
-            if a.has_guard():
-                parts.append('condition=self.is_{}'.format(trigger_name))
-            if a.has_behavior():
-                parts.append('action=self.on_{}'.format(trigger_name))
+                     'events=[{}]'.format(self.__signals[name])] + handler_parts
             parent = source.get_parent()
-            if parent.get_type() == CyberiadaML.elementSM:
-                owner = 'self.__sm'
+            if parent.get_type() == self.__ml.elementSM:
+                owner = 'self.{p}sm'.format(p=self.__prefix)
             else:
                 owner = 'st_{}'.format(self.__get_state_name(parent))
             self.__w8(f, '{}.add_transition({})\n'.format(owner, ', '.join(parts)))
 
     def __write_standard_functions(self, f):
         self.__w(f, '\n')
-        self.__w4(f, 'def initialize(self):\n')
+        self.__write_def(f, 'initialize', 'self', 'self', 'None')
         if self.__use_ticks:
-            self.__w8(f, 'self.__time = self.__prev_time = time.time()\n')
-        self.__w8(f, 'self.__sm.initialize()\n')
-        self.__w8(f, 'self.__sm.dispatch(self.InitEvent)\n')
+            self.__w8(f, 'self.{p}time = self.{p}prev_time = time.time()\n'.format(p=self.__prefix))
+        self.__w8(f, 'self.{p}sm.initialize()\n'.format(p=self.__prefix))
+        self.__w8(f, 'self.{p}sm.dispatch(self.InitEvent)\n'.format(p=self.__prefix))
         self.__w(f, '\n')
-        self.__w4(f, 'def dispatch(self, eventstr=None, arg=None):\n')
+        self.__write_def(f, 'dispatch', 'self, eventstr=None, arg=None',
+                         'self, eventstr: Optional[str] = None, arg: Optional[str] = None', 'None')
         if self.__use_ticks:
             self.__dispatch_tick(f)
-        self.__w8(f, 'if eventstr is not None and eventstr in self.__events:\n')
-        self.__w8(f, '    if arg is None:\n')
-        self.__w8(f, '        self.__sm.dispatch(self.__events[eventstr])\n')
-        self.__w8(f, '    else:\n')
-        self.__w8(f, '        args = {"value": arg}\n')
-        self.__w8(f, '        self.__sm.dispatch(pysm.Event(eventstr, **args))\n')
-        self.__w8(f, 'while self.__event_queue:\n')
-        self.__w8(f, '    eventstr = self.__event_queue.pop(0)\n')
-        self.__w8(f, '    if eventstr in self.__events:\n')
-        self.__w8(f, '        self.__sm.dispatch(self.__events[eventstr])\n')
+        self.__write_block(f, 'dispatch')
         
         self.__w(f, '\n')
-        self.__w4(f, 'def loop(self):\n')
-        self.__w8(f, 'while not self.__terminated:\n')
+        self.__write_def(f, 'loop', 'self', 'self', 'None')
+        self.__w8(f, 'while not self.{p}terminated:\n'.format(p=self.__prefix))
+        self.__w8(f, '    self.step()\n')
+        if self.__use_ticks and self.__generate_loop:
+            self.__w8(f, '    time.sleep(self.{p}sleep_len)\n'.format(p=self.__prefix))
+        self.__w(f, '\n')
+        self.__write_def(f, 'step', 'self', 'self', 'None')
         for l in self.__loop:
-            self.__w8(f, '    {}\n'.format(l))
+            self.__w8(f, '{}\n'.format(l))
         if self.__use_ticks:
-            self.__w8(f, '    self.dispatch()\n')
-            self.__w8(f, '    time.sleep(self.__sleep_len)\n')
+            self.__w8(f, 'self.dispatch()\n')
+        if not self.__loop and not self.__use_ticks:
+            self.__w8(f, 'pass\n')
+        self.__w(f, '\n')
+        self.__write_def(f, 'is_terminated', 'self', 'self', 'bool')
+        self.__w8(f, 'return self.{p}terminated\n'.format(p=self.__prefix))
         self.__w(f, '\n')
-        self.__w4(f, 'def terminate(self, *_):\n')
-        self.__w8(f, 'self.__terminated = True\n')
+        self.__write_def(f, 'terminate', 'self, *_',
+                         'self, state: Optional[pysm.State] = None, event: Optional[pysm.Event] = None', 'None')
+        self.__w8(f, 'self.{p}terminated = True\n'.format(p=self.__prefix))
+        if self.__offload_actions:
+            self.__w8(f, 'self.{p}executor.shutdown(wait=False)\n'.format(p=self.__prefix))
         if self.__exit_on_term:
             self.__w8(f, 'sys.exit(0)\n')
         self.__w(f, '\n')
-        self.__w4(f, 'def push_event(self, event):\n')
-        self.__w8(f, 'self.__event_queue.append(event)\n')
+        self.__write_def(f, 'push_event', 'self, event', 'self, event: str', 'None')
+        self.__w8(f, 'self.{p}event_queue.append(event)\n'.format(p=self.__prefix))
+        if self.__offload_actions:
+            self.__write_offload_functions(f)
 
-    def __write_running_loop(self, f):
+    def __write_offload_functions(self, f):
+        self.__w(f, '\n')
+        self.__write_def(f, '__offload', 'self, action, done_event, error_event, *args',
+                         'self, action: Callable[..., None], done_event: Optional[str], error_event: Optional[str], ' +
+                         '*args: Any', 'None')
+        self.__write_block(f, 'offload')
+        self.__w(f, '\n')
+        self.__write_def(f, '__offload_done', 'self, future, done_event, error_event',
+                         'self, future: "concurrent.futures.Future[None]", done_event: Optional[str], ' +
+                         'error_event: Optional[str]', 'None')
+        self.__w8(f, 'error = future.exception()\n')
+        self.__w8(f, 'if error is None:\n')
+        self.__w8(f, '    if done_event is not None:\n')
+        self.__w8(f, '        self.push_event(done_event)\n')
+        self.__w8(f, 'elif error_event is not None:\n')
+        self.__w8(f, '    self.push_event(error_event)\n')
+        self.__w8(f, 'else:\n')
+        self.__w8(f, '    sys.stderr.write("Offloaded action failed: {}\\n".format(error))\n')
+
+    def __write_offload_imports(self, f):
+        if self.__offload_actions:
+            self.__w(f, '\n# Offloaded actions:\n')
+            self.__w(f, 'import concurrent.futures\n\n')
+            self.__w(f, 'OFFLOAD_WORKERS = {}\n'.format(OFFLOAD_WORKERS))
+
+    def __write_instance(self, f):
         self.__w(f, '\n')
         self.__w(f, '{} = {}()\n'.format(self.__sm_name, self.__sm_name_cap))
+        self.__w(f, 'MACHINES["{0}"] = {0}\n'.format(self.__sm_name))
+
+    def __write_running_loop(self, f):
+        self.__write_instance(f)
         self.__w(f, '{}.initialize()\n'.format(self.__sm_name))
         self.__w(f, '{}.loop()\n'.format(self.__sm_name))
 
     def __write_external_dispacth(self, f):
         self.__w(f, '\n')
-        self.__w(f, 'def DISPATCH(event):\n')
+        if self.__typed:
+            self.__w(f, 'def DISPATCH(event: str) -> None:\n')
+        else:
+            self.__w(f, 'def DISPATCH(event):\n')
         self.__w4(f, '{}.push_event(event)\n'.format(self.__sm_name))
 
     def __init_tick(self, f):
-        self.__w8(f, '# Tick events constants & variables\n')
-        self.__w8(f, 'self.__time = self.__prev_time = self.__tick = self.__tick_1s = 0\n')
-        self.__w8(f, 'self.__tick_len = TICK_LEN / 1000.0\n')
+        self.__write_block(f, 'init_tick')
         if self.__generate_loop:
-            self.__w8(f, 'self.__sleep_len = self.__tick_len\n')
+            self.__w8(f, 'self.{p}sleep_len = self.{p}tick_len\n'.format(p=self.__prefix))
 
     def __dispatch_tick(self, f):
-        self.__w8(f, '# Check tick events\n')
-        self.__w8(f, 'self.__time = time.time()\n')
-        self.__w8(f, 'timedelta = self.__time - self.__prev_time\n')
-        self.__w8(f, 'self.__prev_time = self.__time\n')
-        self.__w8(f, 'self.__tick += timedelta\n')
-        self.__w8(f, 'self.__tick_1s += timedelta\n')
-        self.__w8(f, 'if self.__tick >= self.__tick_len:\n')
-        self.__w8(f, '    while self.__tick >= self.__tick_len:\n')
-        self.__w8(f, '        self.__tick -= self.__tick_len\n')
-        self.__w8(f, '    self.__sm.dispatch(self.TickEvent)\n')
-        self.__w8(f, 'if self.__tick_1s >= 1.0:\n')
-        self.__w8(f, '    while self.__tick_1s >= 1.0:\n')
-        self.__w8(f, '        self.__tick_1s -= 1.0\n')
-        self.__w8(f, '    self.__sm.dispatch(self.Tick1SecEvent)\n')
+        self.__write_block(f, 'dispatch_tick')
 
     def __insert_python_modules(self, f, basepath):
         path = os.path.dirname(os.path.abspath(basepath))
@@ -573,14 +934,13 @@ class CodeGenerator:
             self.__w(f, '# code imported from {}\n'.format(name))
             self.__insert_file(f, filename)
 
-    def generate_code(self, target=None):
-        if target is not None:
-            _f = open(target, 'w')
-        else:
-            _f = sys.stdout
-
+    def generate(self, encoding=None):
+        # returns the module code as str (or bytes if the encoding is set)
+        _f = CodeBuilder()
+        self.__reset_handlers()
         self.__write_technical_info(_f)
-        self.__insert_file(_f, HEADER_TEMPLATE)
+        self.__insert_template(_f, TYPED_HEADER_TEMPLATE if self.__typed else HEADER_TEMPLATE)
+        self.__write_offload_imports(_f)
         self.__write_global_init(_f)
         self.__write_class(_f)
         self.__write_entries(_f)
@@ -591,10 +951,120 @@ class CodeGenerator:
         self.__write_transitions(_f)
         self.__write_standard_functions(_f)
         self.__insert_python_modules(_f, self.__graph_file)
-        if self.__generate_loop:
+        if self.__package:
+            # the package runs the machines, the module only creates the instance
+            self.__write_external_dispacth(_f)
+            self.__write_instance(_f)
+        elif self.__generate_loop:
             self.__write_external_dispacth(_f)
             self.__write_running_loop(_f)
-        self.__insert_file(_f, FOOTER_TEMPLATE)
+        self.__insert_template(_f, FOOTER_TEMPLATE)
+        return _f.getvalue(encoding)
+
+    def generate_code(self, target=None):
+        write_code(self.generate(), target)
+
+class DocumentGenerator:
+
+    def __init__(self, graph_file, **kwargs):
+        self.__graph_file = graph_file
+        self.__typed = kwargs['typed'] if 'typed' in kwargs else False
+        self.__generate_loop = kwargs['generate_loop'] if 'generate_loop' in kwargs else False
+        # the document can be already parsed, e.g. by the generator server
+        document = kwargs.get('document')
+        if document is None:
+            document = open_document(graph_file,
+                                     kwargs['frontend'] if 'frontend' in kwargs else None,
+                                     kwargs['graph_format'] if 'graph_format' in kwargs else 'detect')
+        sm_count = len(document[1].get_state_machines())
+        options = dict(kwargs)
+        options['document'] = document
+        options['package'] = sm_count > 1
+        self.__generators = []
+        names = set([])
+        for i in range(sm_count):
+            options['state_machine'] = i
+            g = CodeGenerator(graph_file, **options)
+            name = g.get_sm_name()
+            if sm_count > 1 or self.__generate_loop:
+                # the machine instance is a module global named after the machine
+                if not name.isidentifier() or keyword.iskeyword(name) or name in RESERVED_NAMES:
+                    raise ParserError('The state machine name "{}" is not a valid module name!\n'.format(name))
+                if name in names:
+                    raise ParserError('The graph {} has two state machines with the same name {}!\n'.format(graph_file,
+                                                                                                            name))
+            names.add(name)
+            self.__generators.append(g)
+
+    def is_package(self):
+        return len(self.__generators) > 1
+
+    def get_generators(self):
+        return self.__generators
+
+    def generate(self, encoding=None):
+        # returns the code of a single module document
+        if self.is_package():
+            raise GeneratorError('The graph {} has several state machines, '.format(self.__graph_file) +
+                                 'use generate_files() to get the package')
+        return self.__generators[0].generate(encoding)
+
+    def generate_code(self, target=None):
+        if not self.is_package():
+            self.__generators[0].generate_code(target)
+            return
+        if target is None or hasattr(target, 'write'):
+            raise GeneratorError('The graph {} has several state machines, '.format(self.__graph_file) +
+                                 'the output package directory is required')
+        os.makedirs(target, exist_ok=True)
+        for filename, code in self.generate_files().items():
+            write_code(code, os.path.join(target, filename))
+
+    def generate_files(self):
+        # returns the package files contents by their names
+        files = {}
+        # the modules are generated one by one: the emission is pure Python and holds
+        # the GIL, and it is cheaper than starting a process pool for the machines
+        for g in self.__generators:
+            files[g.get_sm_name() + '.py'] = g.generate()
+        f = CodeBuilder()
+        self.__write_registry(f)
+        files[PACKAGE_INIT] = f.getvalue()
+        if self.__generate_loop:
+            f = CodeBuilder()
+            self.__write_package_loop(f)
+            files[PACKAGE_MAIN] = f.getvalue()
+        return files
+
+    def __write_registry(self, f):
+        names = [g.get_sm_name() for g in self.__generators]
+        f.write('# The SM package based on {} file\n'.format(self.__graph_file))
+        f.write('# Generated by HSM-to-Python script version {}\n\n'.format(CodeGenerator.VERSION))
+        if self.__typed:
+            f.write('from typing import Any, Dict\n\n')
+        f.write('from . import {}\n'.format(', '.join(names)))
+        f.write('\n# State machines registry:\n')
+        if self.__typed:
+            f.write('MACHINES: Dict[str, Any] = {\n')
+        else:
+            f.write('MACHINES = {\n')
+        for name in names:
+            f.write('    "{0}": {0}.{0},\n'.format(name))
+        f.write('}\n')
+        f.write('\n# DISPATCH_SM() can address any machine of the package by name\n')
+        for name in names:
+            f.write('{}.MACHINES.update(MACHINES)\n'.format(name))
 
-        if target is not None:
-            _f.close()
+    def __write_package_loop(self, f):
+        f.write('# The SM package running loop\n')
+        f.write('# Generated by HSM-to-Python script version {}\n\n'.format(CodeGenerator.VERSION))
+        f.write('import time\n\n')
+        f.write('from . import MACHINES\n')
+        f.write('from .{} import TICK_LEN\n\n'.format(self.__generators[0].get_sm_name()))
+        f.write('for sm in MACHINES.values():\n')
+        f.write('    sm.initialize()\n')
+        f.write('while not all(sm.is_terminated() for sm in MACHINES.values()):\n')
+        f.write('    for sm in MACHINES.values():\n')
+        f.write('        if not sm.is_terminated():\n')
+        f.write('            sm.step()\n')
+        f.write('    time.sleep(TICK_LEN / 1000.0)\n')
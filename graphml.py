@@ -0,0 +1,475 @@
+# -----------------------------------------------------------------------------
+#  HSM-to-Python conversion tool
+#
+#  The lightweight streaming graphml reader
+#
+#  Copyright (C) 2025 Alexey Fedoseev <aleksey@fedoseev.net>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see https://www.gnu.org/licenses/
+#
+#  -----------------------------------------------------------------------------
+
+# The module mimics the subset of the CyberiadaML binding API used by the
+# code generator. The document is read with iterparse and every XML element is
+# dropped as soon as it is processed, so geometry, styles and other unneeded
+# data never stay in memory.
+
+import re
+import xml.etree.ElementTree as ET
+
+# element types
+elementSM = 'sm'
+elementSimpleState = 'simple state'
+elementCompositeState = 'composite state'
+elementInitial = 'initial'
+elementFinal = 'final'
+elementChoice = 'choice'
+elementTerminate = 'terminate'
+elementComment = 'comment'
+elementTransition = 'transition'
+
+# action types
+actionTransition = 'transition'
+actionEntry = 'entry'
+actionExit = 'exit'
+
+# document formats
+formatDetect = 'detect'
+formatCyberiada10 = 'cyberiada'
+formatLegacyYED = 'yed'
+
+# geometry is never loaded, the constant is kept for API compatibility
+geometryFormatNone = None
+
+CYBERIADA_FORMAT_PREFIX = 'Cyberiada-GraphML'
+CYBERIADA_META_NAME = 'CGML_META'
+DEFAULT_SM_NAME = 'SM'
+
+CYBERIADA_VERTEXES = {'initial': elementInitial,
+                      'final': elementFinal,
+                      'choice': elementChoice,
+                      'terminate': elementTerminate}
+
+YED_ENTITY_NAME = 'com.yworks.entityRelationship.label.name'
+YED_BPMN_EVENT = 'com.yworks.bpmn.Event'
+YED_BPMN_GATEWAY = 'com.yworks.bpmn.Gateway'
+YED_BPMN_CHARACTERISTIC = 'com.yworks.bpmn.characteristic'
+YED_EVENT_START = 'EVENT_CHARACTERISTIC_START'
+YED_NODE_KINDS = ('GroupNode', 'GenericNode', 'ShapeNode', 'UMLNoteNode', 'SVGNode')
+
+ACTION_HEADER = re.compile(r'^\s*(?P<trigger>[A-Za-z_]\w*(\s*\([^)]*\))?)\s*(\[(?P<guard>.*)\])?\s*/(?!=)(?P<rest>.*)$')
+
+class GraphmlError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+class Action:
+    __slots__ = ('__type', '__trigger', '__guard', '__behavior')
+
+    def __init__(self, action_type, trigger='', guard='', behavior=''):
+        self.__type = action_type
+        self.__trigger = trigger
+        self.__guard = guard
+        self.__behavior = behavior
+
+    def get_type(self):
+        return self.__type
+    def get_trigger(self):
+        return self.__trigger
+    def get_guard(self):
+        return self.__guard
+    def get_behavior(self):
+        return self.__behavior
+    def has_trigger(self):
+        return len(self.__trigger) > 0
+    def has_guard(self):
+        return len(self.__guard) > 0
+    def has_behavior(self):
+        return len(self.__behavior) > 0
+
+class Element:
+    __slots__ = ('_id', '_type', '_name', '_parent', '_children', '_actions', '_body')
+
+    def __init__(self, element_id, parent):
+        self._id = element_id
+        self._type = elementSimpleState
+        self._name = ''
+        self._parent = parent
+        self._children = []
+        self._actions = []
+        self._body = ''
+
+    def get_id(self):
+        return self._id
+    def get_type(self):
+        return self._type
+    def get_name(self):
+        return self._name
+    def get_parent(self):
+        return self._parent
+    def get_children(self):
+        return self._children
+    def get_actions(self):
+        return self._actions
+    def get_body(self):
+        return self._body
+
+    # the setters are used by the parser
+    def set_type(self, element_type):
+        self._type = element_type
+    def set_name(self, name):
+        self._name = name
+    def set_actions(self, actions):
+        self._actions = actions
+    def set_body(self, body):
+        self._body = body
+
+    def get_qualified_name(self):
+        names = []
+        element = self
+        while element is not None and element.get_type() != elementSM:
+            names.append(element.get_name())
+            element = element.get_parent()
+        return '::'.join(reversed(names))
+
+class Transition(Element):
+    __slots__ = ('_source_id', '_target_id', '_action')
+
+    def __init__(self, element_id, parent, source_id, target_id):
+        Element.__init__(self, element_id, parent)
+        self._type = elementTransition
+        self._source_id = source_id
+        self._target_id = target_id
+        self._action = Action(actionTransition)
+
+    def get_source_element_id(self):
+        return self._source_id
+    def get_target_element_id(self):
+        return self._target_id
+    def get_action(self):
+        return self._action
+    def set_action(self, action):
+        self._action = action
+
+class StateMachine(Element):
+    __slots__ = ('_elements',)
+
+    def __init__(self, element_id):
+        Element.__init__(self, element_id, None)
+        self._type = elementSM
+        self._elements = {}
+
+    def find_element_by_id(self, element_id):
+        if element_id not in self._elements:
+            raise GraphmlError('Cannot find element {} in the state machine {}'.format(element_id,
+                                                                                       self._name))
+        return self._elements[element_id]
+
+    def add_element(self, element):
+        self._elements[element.get_id()] = element
+
+    def remove_element(self, element):
+        del self._elements[element.get_id()]
+
+    def find_elements_by_type(self, element_type):
+        return self.find_elements_by_types([element_type])
+
+    def find_elements_by_types(self, element_types):
+        result = []
+        self.__collect(self, element_types, result)
+        return result
+
+    @classmethod
+    def __collect(cls, element, element_types, result):
+        for ch in element.get_children():
+            if ch.get_type() in element_types:
+                result.append(ch)
+            cls.__collect(ch, element_types, result)
+
+def _strip_lines(text):
+    lines = text.split('\n')
+    while lines and len(lines[0].strip()) == 0:
+        lines.pop(0)
+    while lines and len(lines[-1].strip()) == 0:
+        lines.pop()
+    return '\n'.join(map(lambda l: l.rstrip(), lines))
+
+def parse_transition_label(text):
+    depth = 0
+    head, behavior = text, ''
+    for i, c in enumerate(text):
+        if c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c == '/' and depth == 0:
+            head = text[:i]
+            rest = text[i + 1:].split('\n', 1)
+            rest[0] = rest[0].strip()
+            behavior = _strip_lines('\n'.join(rest))
+            break
+    guard = ''
+    open_idx = head.find('[')
+    close_idx = head.rfind(']')
+    if 0 <= open_idx < close_idx:
+        guard = head[open_idx + 1:close_idx].strip()
+        head = head[:open_idx]
+    return Action(actionTransition, ' '.join(head.split()), guard, behavior)
+
+def parse_state_actions(text):
+    actions = []
+    header = None
+    body = []
+    def flush():
+        if header is None:
+            return
+        trigger, guard = header
+        behavior = _strip_lines('\n'.join(body))
+        if trigger == 'entry' and not guard:
+            actions.append(Action(actionEntry, '', '', behavior))
+        elif trigger == 'exit' and not guard:
+            actions.append(Action(actionExit, '', '', behavior))
+        else:
+            actions.append(Action(actionTransition, trigger, guard, behavior))
+    # like libcyberiada, an action header starts the text or follows an empty line,
+    # so the code lines such as "total = a / b" stay in the action body
+    block_start = True
+    for line in text.split('\n'):
+        m = ACTION_HEADER.match(line) if block_start else None
+        block_start = not line.strip()
+        if m:
+            flush()
+            header = (''.join(m.group('trigger').split()), (m.group('guard') or '').strip())
+            body = [m.group('rest').strip()]
+        elif header is not None:
+            body.append(line)
+    flush()
+    return actions
+
+class _Node:
+    __slots__ = ('element', 'labels', 'kind', 'configuration', 'characteristic',
+                 'vertex', 'note', 'data', 'active', 'realizer')
+
+    def __init__(self, element):
+        self.element = element
+        self.labels = []
+        self.kind = None
+        self.configuration = ''
+        self.characteristic = None
+        self.vertex = None
+        self.note = None
+        self.data = ''
+        self.active = None
+        self.realizer = -1
+
+class _Parser:
+    def __init__(self, file_format):
+        self.__format = file_format
+        self.__sms = []
+        self.__sm = None
+        self.__sm_names = {}
+        self.__keys = {}
+        self.__graph_depth = 0
+        self.__nodes = []
+        self.__edge = None
+        self.__edge_labels = []
+        self.__transitions = []
+
+    def state_machines(self):
+        return self.__sms
+
+    @classmethod
+    def __local(cls, tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def parse(self, source):
+        stack = []
+        try:
+            for event, elem in ET.iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    self.__start(self.__local(elem.tag), elem)
+                else:
+                    stack.pop()
+                    self.__end(self.__local(elem.tag), elem)
+                    # everything is already processed, drop the element
+                    elem.clear()
+                    if stack:
+                        stack[-1].remove(elem)
+        except ET.ParseError as e:
+            raise GraphmlError('Bad XML document: {}'.format(e)) from e
+        if not self.__sms:
+            raise GraphmlError('No state machines found in the document')
+        for sm in self.__sms:
+            self.__finalize(sm)
+
+    def __detect(self, file_format):
+        if self.__format == formatDetect:
+            self.__format = file_format
+        elif self.__format != file_format:
+            raise GraphmlError('The document is not in the {} format'.format(self.__format))
+
+    def __start(self, tag, elem):
+        if tag == 'key':
+            self.__keys[elem.get('id')] = (elem.get('for'), elem.get('attr.name'))
+            if elem.get('yfiles.type') is not None:
+                self.__detect(formatLegacyYED)
+        elif tag == 'graph':
+            if self.__format == formatDetect:
+                raise GraphmlError('Cannot detect the graphml document format')
+            if self.__graph_depth == 0 and (self.__sm is None or self.__format == formatCyberiada10):
+                self.__sm = StateMachine(elem.get('id', 'G'))
+                self.__sm_names[self.__sm] = ''
+                self.__sms.append(self.__sm)
+            self.__graph_depth += 1
+        elif tag == 'node':
+            parent = self.__nodes[-1].element if self.__nodes else self.__sm
+            element = Element(elem.get('id'), parent)
+            parent.get_children().append(element)
+            self.__sm.add_element(element)
+            self.__nodes.append(_Node(element))
+        elif tag == 'edge':
+            self.__edge = Transition(elem.get('id'), self.__sm, elem.get('source'), elem.get('target'))
+            self.__edge_labels = []
+        elif self.__edge is not None or not self.__nodes:
+            return
+        elif tag == 'Realizers':
+            self.__nodes[-1].active = int(elem.get('active', '0'))
+        elif tag in YED_NODE_KINDS:
+            node = self.__nodes[-1]
+            node.realizer += 1
+            if node.kind is None:
+                node.kind = tag
+                node.configuration = elem.get('configuration', '')
+
+    def __end(self, tag, elem):
+        if tag == 'data':
+            self.__end_data(elem.get('key'), elem.text or '')
+        elif tag == 'graph':
+            self.__graph_depth -= 1
+        elif tag == 'node':
+            self.__end_node(self.__nodes.pop())
+        elif tag == 'edge':
+            if self.__format == formatLegacyYED:
+                self.__edge.set_action(parse_transition_label('\n'.join(self.__edge_labels)))
+            self.__transitions.append((self.__sm, self.__edge))
+            self.__edge = None
+        elif tag == 'EdgeLabel' and self.__edge is not None:
+            if elem.text and elem.text.strip():
+                self.__edge_labels.append(elem.text)
+        elif self.__edge is not None or not self.__nodes:
+            return
+        elif tag == 'NodeLabel':
+            node = self.__nodes[-1]
+            if node.active is None or node.realizer == node.active:
+                node.labels.append((elem.get('configuration', ''), elem.text or ''))
+        elif tag == 'Property':
+            if elem.get('name') == YED_BPMN_CHARACTERISTIC:
+                self.__nodes[-1].characteristic = elem.get('value')
+
+    def __end_data(self, key, text):
+        if key == 'gFormat':
+            if text.strip().startswith(CYBERIADA_FORMAT_PREFIX):
+                self.__detect(formatCyberiada10)
+            return
+        if self.__format != formatCyberiada10:
+            # yEd graph description is used as the state machine name
+            if (self.__keys.get(key) == ('graph', 'Description') and self.__sm is not None and
+                    self.__graph_depth == 1 and not self.__nodes):
+                self.__sm_names[self.__sm] = text.strip()
+            return
+        if self.__edge is not None:
+            if key == 'dData':
+                self.__edge.set_action(parse_transition_label(text))
+        elif self.__nodes:
+            node = self.__nodes[-1]
+            if key == 'dName':
+                node.element.set_name(text.strip())
+            elif key == 'dData':
+                node.data = text
+            elif key == 'dVertex':
+                node.vertex = text.strip()
+            elif key == 'dNote':
+                node.note = text.strip()
+        elif self.__sm is not None and key == 'dName':
+            self.__sm_names[self.__sm] = text.strip()
+
+    def __end_node(self, node):
+        element = node.element
+        if self.__format == formatCyberiada10:
+            if node.note is not None:
+                element.set_type(elementComment)
+                element.set_body(node.data)
+            elif node.vertex is not None:
+                if node.vertex not in CYBERIADA_VERTEXES:
+                    raise GraphmlError('Unsupported vertex type {} of node {}'.format(node.vertex,
+                                                                                      element.get_id()))
+                element.set_type(CYBERIADA_VERTEXES[node.vertex])
+            else:
+                element.set_actions(parse_state_actions(node.data))
+        elif node.kind == 'UMLNoteNode':
+            element.set_type(elementComment)
+            element.set_body(node.labels[0][1] if node.labels else '')
+        elif node.configuration.startswith(YED_BPMN_EVENT):
+            element.set_type(elementInitial if node.characteristic == YED_EVENT_START else elementFinal)
+        elif node.configuration.startswith(YED_BPMN_GATEWAY):
+            element.set_type(elementChoice)
+        else:
+            labels = node.labels
+            if labels and labels[0][0] != YED_ENTITY_NAME:
+                labels = sorted(labels, key=lambda l: l[0] != YED_ENTITY_NAME)
+            if labels:
+                element.set_name(labels[0][1].strip())
+            if len(labels) > 1:
+                element.set_actions(parse_state_actions(labels[1][1]))
+        if element.get_type() in (elementSimpleState, elementCompositeState):
+            states = [ch for ch in element.get_children() if ch.get_type() != elementComment]
+            element.set_type(elementCompositeState if states else elementSimpleState)
+
+    def __finalize(self, sm):
+        meta = [ch for ch in sm.get_children() if ch.get_name() == CYBERIADA_META_NAME and
+                ch.get_type() == elementComment]
+        for ch in meta:
+            sm.get_children().remove(ch)
+            sm.remove_element(ch)
+        for owner, t in self.__transitions:
+            if owner is sm:
+                sm.get_children().append(t)
+                sm.add_element(t)
+        name = self.__sm_names[sm]
+        if not name:
+            states = [ch for ch in sm.get_children() if ch.get_type() in (elementSimpleState,
+                                                                          elementCompositeState)]
+            name = states[0].get_name() if states else DEFAULT_SM_NAME
+        sm.set_name(name)
+
+class LocalDocument:
+    def __init__(self):
+        self.__sms = []
+
+    def open(self, path, *args):
+        # the geometry and the other native binding options are ignored
+        parser = _Parser(args[0] if args else formatDetect)
+        try:
+            with open(path, 'rb') as source:
+                parser.parse(source)
+        except OSError as e:
+            raise GraphmlError('Cannot read file {}: {}'.format(path, e)) from e
+        self.__sms = parser.state_machines()
+
+    def get_state_machines(self):
+        return self.__sms
@@ -22,30 +22,73 @@
 #  -----------------------------------------------------------------------------
 
 import sys
+import getopt
 import traceback
 
 import gencode
 
 def usage():
-    print('usage: {} <diagram.graphml> [output.py]'.format(sys.argv[0]))
+    print('usage: {} [options] <diagram.graphml> [output.py | output-package-dir]'.format(sys.argv[0]))
+    print('       {} --serve [socket-path]'.format(sys.argv[0]))
+    print('options:')
+    print('  -s, --stream             use the lightweight streaming graphml frontend')
+    print('  -n, --native             use the native CyberiadaML frontend')
+    print('  -f, --format <format>    graph format: detect (default), cyberiada, yed')
+    print('  -O, --optimize           share identical handlers and drop empty ones')
+    print('  -t, --typed              generate type-annotated code compilable with mypyc')
+    print('      --serve              run the persistent generator server on a Unix socket')
     sys.exit(1)
 
 if __name__ == '__main__':
 
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'snf:Ot', ['stream', 'native', 'format=', 'optimize', 'typed',
+                                                                 'serve'])
+    except getopt.GetoptError:
+        usage()
+
+    if ('--serve', '') in opts:
+        if len(args) > 1:
+            usage()
+        import server
+        try:
+            server.serve(*args)
+        except server.ServerError as e:
+            sys.stderr.write('Server error: {}\n'.format(e))
+            sys.exit(5)
+        sys.exit(0)
+
+    if len(args) < 1 or len(args) > 2:
         usage()
 
-    graph = sys.argv[1]
+    frontend = None
+    graph_format = 'detect'
+    optimize = False
+    typed = False
+    for opt, value in opts:
+        if opt in ('-s', '--stream'):
+            frontend = gencode.FRONTEND_STREAM
+        elif opt in ('-n', '--native'):
+            frontend = gencode.FRONTEND_NATIVE
+        elif opt in ('-f', '--format'):
+            if value not in gencode.GRAPH_FORMATS:
+                usage()
+            graph_format = value
+        elif opt in ('-O', '--optimize'):
+            optimize = True
+        elif opt in ('-t', '--typed'):
+            typed = True
+
+    graph = args[0]
 
-    if len(sys.argv) == 3:
-        output = sys.argv[2]
+    if len(args) == 2:
+        output = args[1]
     else:
         output = None
 
-    graph = sys.argv[1]
-
     try:
-        g = gencode.CodeGenerator(graph, generate_loop=True)
+        g = gencode.DocumentGenerator(graph, generate_loop=True, frontend=frontend, graph_format=graph_format,
+                                  optimize=optimize, typed=typed)
         g.generate_code(output)
     except gencode.ParserError as e:
         sys.stderr.write('Graph parsing error: {}\n'.format(e))
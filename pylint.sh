@@ -1,6 +1,6 @@
 #!/bin/bash
 
-FILES="hsm.py gencode.py"
+FILES="hsm.py gencode.py graphml.py server.py"
 pylint --disable=I1101,C0301,W0703 $FILES
 
 
@@ -0,0 +1,246 @@
+# -----------------------------------------------------------------------------
+#  HSM-to-Python conversion tool
+#
+#  The persistent generator server
+#
+#  Copyright (C) 2025 Alexey Fedoseev <aleksey@fedoseev.net>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see https://www.gnu.org/licenses/
+#
+#  -----------------------------------------------------------------------------
+
+# The server listens on a local Unix socket and handles one request per
+# connection. The request is a single JSON line:
+#
+#   {"graph": "/path/to/diagram.graphml", "options": {"optimize": true}}
+#
+# and the response is a single JSON line with the generated code (or the
+# package files for multi-machine documents) and the diagnostics:
+#
+#   {"status": "ok", "code": "...", "diagnostics": []}
+#   {"status": "ok", "files": {"__init__.py": "...", ...}, "diagnostics": []}
+#   {"status": "error", "error": "parser", "diagnostics": ["..."]}
+
+import os
+import sys
+import json
+import stat
+import signal
+import socket
+import socketserver
+import tempfile
+import traceback
+import collections
+
+import gencode
+
+MODEL_CACHE_SIZE = 32
+REQUEST_LIMIT = 1024 * 1024
+REQUEST_TIMEOUT = 5.0 # seconds
+SOCKET_NAME = 'hsm-to-python.sock'
+PRIVATE_DIR = 'hsm-to-python-{}'.format(os.getuid())
+DOCUMENT_OPTIONS = ('frontend', 'graph_format')
+GENERATOR_OPTIONS = ('exit_on_term', 'allow_empty_trans', 'generate_loop', 'use_ticks',
+                     'optimize', 'typed') + DOCUMENT_OPTIONS
+
+class RequestError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+class ServerError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+class ModelCache:
+    def __init__(self, size=MODEL_CACHE_SIZE):
+        self.__size = size
+        self.__documents = collections.OrderedDict()
+
+    def get(self, graph_file, frontend=None, graph_format='detect'):
+        # the document is parsed again when the file is modified
+        st = os.stat(graph_file)
+        key = (os.path.realpath(graph_file), st.st_mtime_ns, st.st_size, frontend, graph_format)
+        if key in self.__documents:
+            self.__documents.move_to_end(key)
+            return self.__documents[key], True
+        document = gencode.open_document(graph_file, frontend, graph_format)
+        self.__documents[key] = document
+        if len(self.__documents) > self.__size:
+            self.__documents.popitem(last=False)
+        return document, False
+
+    def __len__(self):
+        return len(self.__documents)
+
+def default_socket():
+    # the socket is placed in a directory only the user can write to,
+    # so another user cannot take the socket name first
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    private_dir = os.path.join(tempfile.gettempdir(), PRIVATE_DIR)
+    try:
+        os.mkdir(private_dir, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(private_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise ServerError('The directory {} is not private to the user'.format(private_dir))
+    return os.path.join(private_dir, SOCKET_NAME)
+
+def check_socket_owner(socket_path, st):
+    if st.st_uid != os.getuid():
+        raise ServerError('The socket {} belongs to another user'.format(socket_path))
+
+def remove_stale_socket(socket_path):
+    # only the socket left by a dead server is removed
+    try:
+        st = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise ServerError('The path {} exists and is not a socket'.format(socket_path))
+    check_socket_owner(socket_path, st)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(socket_path)
+                return
+    except PermissionError as e:
+        raise ServerError('Cannot check the socket {}: {}'.format(socket_path, e)) from e
+    raise ServerError('Another server is listening on {}'.format(socket_path))
+
+class GeneratorServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path=None, cache_size=MODEL_CACHE_SIZE):
+        if socket_path is None:
+            socket_path = default_socket()
+        remove_stale_socket(socket_path)
+        self.socket_path = socket_path
+        self.__socket_id = None
+        self.models = ModelCache(cache_size)
+        # the templates are loaded before the first request
+        for template in (gencode.HEADER_TEMPLATE, gencode.TYPED_HEADER_TEMPLATE, gencode.FOOTER_TEMPLATE):
+            gencode.load_template(template)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, GeneratorRequestHandler)
+        except PermissionError as e:
+            raise ServerError('Cannot listen on {}: {}'.format(socket_path, e)) from e
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        st = os.stat(self.socket_path)
+        self.__socket_id = (st.st_dev, st.st_ino)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        # the path could be taken by another file after the server start
+        try:
+            st = os.stat(self.socket_path)
+        except FileNotFoundError:
+            return
+        if self.__socket_id == (st.st_dev, st.st_ino) and stat.S_ISSOCK(st.st_mode):
+            os.unlink(self.socket_path)
+
+    def convert(self, query):
+        if not isinstance(query, dict) or not isinstance(query.get('graph'), str):
+            raise RequestError('The request should be an object with the "graph" path')
+        options = query.get('options', {})
+        if not isinstance(options, dict):
+            raise RequestError('The request options should be an object')
+        for name in options:
+            if name not in GENERATOR_OPTIONS:
+                raise RequestError('Unknown generator option {}'.format(name))
+        graph_file = query['graph']
+        if not os.path.isabs(graph_file):
+            # the server working directory is not the client one
+            raise RequestError('The graph path {} should be absolute'.format(graph_file))
+        if not os.path.isfile(graph_file):
+            raise RequestError('Cannot find the graph file {}'.format(graph_file))
+        document, cached = self.models.get(graph_file,
+                                           options.get('frontend'),
+                                           options.get('graph_format', 'detect'))
+        g = gencode.DocumentGenerator(graph_file, document=document, **options)
+        response = {'status': 'ok', 'cached': cached, 'diagnostics': []}
+        if g.is_package():
+            response['files'] = g.generate_files()
+        else:
+            response['code'] = g.generate()
+        return response
+
+class GeneratorRequestHandler(socketserver.StreamRequestHandler):
+    # a silent client cannot stall the single-threaded server
+    timeout = REQUEST_TIMEOUT
+
+    def handle(self):
+        try:
+            line = self.rfile.readline(REQUEST_LIMIT)
+        except socket.timeout:
+            self.__send(self.__error('request', 'The request is not received in {} s'.format(self.timeout)))
+            return
+        if not line:
+            # the client has closed the connection, e.g. the liveness check
+            return
+        try:
+            response = self.server.convert(json.loads(line))
+        except (ValueError, RequestError) as e:
+            response = self.__error('request', e)
+        except gencode.ParserError as e:
+            response = self.__error('parser', e)
+        except gencode.GeneratorError as e:
+            response = self.__error('generator', e)
+        except gencode.ConvertorError as e:
+            response = self.__error('convertor', e)
+        except Exception as e:
+            response = self.__error('internal', '{}\n{}'.format(e.__class__, traceback.format_exc()))
+        self.__send(response)
+
+    def __send(self, response):
+        try:
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        except OSError:
+            # the client has gone
+            pass
+
+    @classmethod
+    def __error(cls, kind, message):
+        return {'status': 'error', 'error': kind, 'diagnostics': [str(message)]}
+
+def request(graph_file, options=None, socket_path=None):
+    if socket_path is None:
+        socket_path = default_socket()
+    # the generated code is trusted only from the own server
+    check_socket_owner(socket_path, os.stat(socket_path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(json.dumps({'graph': os.path.abspath(graph_file), 'options': options or {}}).encode('utf-8') + b'\n')
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+def serve(socket_path=None):
+    # the socket is removed when the server is stopped by a signal
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    with GeneratorServer(socket_path) as server:
+        sys.stderr.write('HSM-to-Python generator is listening on {}\n'.format(server.socket_path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
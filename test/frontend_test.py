@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -----------------------------------------------------------------------------
+# The HSM-to-Python graphml frontends comparison
+#
+# Copyright (C) 2023-2025      Alexey Fedoseev <aleksey@fedoseev.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see https://www.gnu.org/licenses/
+# -----------------------------------------------------------------------------
+
+import sys
+import os
+import tempfile
+
+sys.path.append('..')
+
+import gencode
+
+TESTS_DIR = 'graphs'
+TEST_GRAPHML_EXT = '.graphml'
+SKIPPED_EXIT_CODE = 77 # the automake convention for skipped tests
+
+def generate(graphfile, frontend):
+    g = gencode.CodeGenerator(graphfile, generate_loop=True, allow_empty_trans=True, frontend=frontend)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'tmp.py')
+        g.generate_code(filename)
+        with open(filename) as f:
+            return f.read()
+
+def run_tests(verbose=False):
+    failed = False
+    for filename in sorted(os.listdir(TESTS_DIR)):
+        if not filename.endswith(TEST_GRAPHML_EXT):
+            continue
+        graphfile = os.path.join(TESTS_DIR, filename)
+        print('Test {}: '.format(filename), end='')
+        try:
+            stream_code = generate(graphfile, gencode.FRONTEND_STREAM)
+        except gencode.ConvertorError as e:
+            stream_code = 'error: {}'.format(e)
+        if gencode.load_native_frontend() is None:
+            # nothing to compare with, the test is not passed
+            print('SKIPPED (the native CyberiadaML frontend is not available)')
+            if verbose:
+                print(stream_code)
+            continue
+        try:
+            native_code = generate(graphfile, gencode.FRONTEND_NATIVE)
+        except gencode.ConvertorError as e:
+            native_code = 'error: {}'.format(e)
+        if native_code != stream_code:
+            print('failed: the frontends output mismatch')
+            if verbose:
+                print('native:\n{}\nstream:\n{}\n'.format(native_code, stream_code))
+            failed = True
+        else:
+            print('OK')
+    return not failed
+
+if __name__ == '__main__':
+    verbose = len(sys.argv) > 1 and sys.argv[1] == '-v'
+    if not run_tests(verbose):
+        sys.exit(1)
+    if gencode.load_native_frontend() is None:
+        print('The frontends comparison is skipped')
+        sys.exit(SKIPPED_EXIT_CODE)
+    sys.exit(0)
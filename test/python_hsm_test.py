@@ -20,25 +20,55 @@
 
 import sys
 import os
+import io
+import time
+import runpy
+import shutil
+import tempfile
+import threading
 import subprocess
+import multiprocessing
+import multiprocessing.connection
 import re
 
-PROGRAM_PREAMBLE = """import sys
-import pysm
-sys.path.append('..')
-"""
-
 TESTS_DIR = 'graphs'
 TEST_PATTERN = re.compile(r'(?P<filebase>[^-]+)(-(?P<number>\d+))?.graphml$')
 TEST_GRAPHML_EXT = '.graphml'
 TEST_OUTPUT_EXT = '.txt'
 TMP_FILE = 'tmp.py'
+TMP_PACKAGE = 'tmp_sm'
 PYTHON_CMD = 'python3'
+TEST_TIMEOUT = 30.0 # seconds of the real time per test
+MIN_JOBS = 4
 
 sys.path.append('..')
 
 import gencode
 
+class VirtualClock:
+    # time.sleep() in the main thread advances the clock instead of waiting,
+    # the timer tests take the same number of ticks without sleeping in real time
+    def __init__(self, start):
+        self.__now = start
+        self.__sleep = time.sleep
+        self.__main_thread = threading.main_thread()
+
+    def time(self):
+        return self.__now
+
+    def sleep(self, seconds):
+        if threading.current_thread() is not self.__main_thread:
+            # the offloaded actions keep blocking their workers
+            self.__sleep(seconds)
+            return
+        self.__now += seconds
+        # let the offload workers run
+        self.__sleep(0)
+
+    def install(self):
+        time.time = self.time
+        time.sleep = self.sleep
+
 def get_tests():
     tests = {}
     
@@ -56,40 +86,167 @@ def get_tests():
 
     return tests
 
-def run_tests(tests, verbose=False):
-    for filebase, numbers in tests.items():
+def run_program(tmpdir, package, isolated):
+    if isolated:
+        if package:
+            command = [PYTHON_CMD, '-m', TMP_PACKAGE]
+        else:
+            command = [PYTHON_CMD, os.path.join(tmpdir, TMP_FILE)]
+        try:
+            result = subprocess.run(command,
+                                    capture_output=True,
+                                    text=True,
+                                    check=False,
+                                    cwd=tmpdir if package else None,
+                                    timeout=TEST_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            return False, '', 'timeout {} s'.format(TEST_TIMEOUT)
+        return result.returncode == 0, result.stdout, result.stderr
+    # the program is executed by the test process itself
+    stdout, stderr = io.StringIO(), io.StringIO()
+    sys.stdout, sys.stderr = stdout, stderr
+    success = True
+    try:
+        VirtualClock(float(int(time.time()))).install()
+        if package:
+            sys.path.insert(0, tmpdir)
+            runpy.run_module(TMP_PACKAGE, run_name='__main__', alter_sys=True)
+        else:
+            runpy.run_path(os.path.join(tmpdir, TMP_FILE), run_name='__main__')
+    except SystemExit as e:
+        success = e.code in (None, 0)
+    except BaseException as e:
+        success = False
+        stderr.write('{}: {}\n'.format(e.__class__.__name__, e))
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    return success, stdout.getvalue(), stderr.getvalue()
+
+def run_test(conn, graphfile, output, tmpdir, options):
+    # executed in a separate process: the tests do not share the modules,
+    # the globals and the clock
+    result = {'gen_time': 0.0, 'run_time': 0.0}
+    isolated = options.pop('isolated')
+    start = time.perf_counter()
+    try:
+        g = gencode.DocumentGenerator(graphfile, generate_loop=True, allow_empty_trans=True, **options)
+        package = g.is_package()
+        g.generate_code(os.path.join(tmpdir, TMP_PACKAGE) if package else os.path.join(tmpdir, TMP_FILE))
+    except gencode.ConvertorError as e:
+        result['gen_time'] = time.perf_counter() - start
+        if output == 'HSMException\n':
+            result['error'] = None
+        else:
+            result['error'] = 'failed: {}'.format(e)
+        conn.send(result)
+        return
+    result['gen_time'] = time.perf_counter() - start
+    start = time.perf_counter()
+    success, stdout, stderr = run_program(tmpdir, package, isolated)
+    result['run_time'] = time.perf_counter() - start
+    if not success:
+        result['error'] = 'Script failed: {}'.format(stderr)
+    elif stdout != output:
+        result['error'] = 'failed: output mismatch, required="{}" output="{}"'.format(output, stdout)
+    else:
+        result['error'] = None
+    conn.send(result)
+
+def get_context():
+    # fork is preferred: the child starts with gencode and pysm already imported
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+def report(filebase, result, tmpdir, verbose):
+    if result['error'] is None:
+        print('Test {}: OK (generation {:.1f} ms, run {:.1f} ms)'.format(filebase,
+                                                                        result['gen_time'] * 1000,
+                                                                        result['run_time'] * 1000))
+        return True
+    print('Test {}: {}\n'.format(filebase, result['error']))
+    if verbose:
+        for filename in (os.path.join(tmpdir, TMP_FILE), os.path.join(tmpdir, TMP_PACKAGE, gencode.PACKAGE_MAIN)):
+            if os.path.isfile(filename):
+                print(' Program {}:\n{}\n'.format(filename, open(filename).read()))
+    return False
+
+def run_tests(tests, verbose=False, optimize=False, typed=False, isolated=False, jobs=None):
+    context = get_context()
+    options = {'optimize': optimize, 'typed': typed, 'isolated': isolated}
+    queue = []
+    for filebase, numbers in sorted(tests.items()):
         if numbers:
-            # multiple diagrams are not supported yet
+            # a test split into several diagram files (name-N.graphml) cannot be
+            # generated as one program; cooperating machines are put into one
+            # document instead, see multi_machines.graphml
+            print('Test {}: SKIPPED ({} diagram files)'.format(filebase, len(numbers)))
             continue
-        filename = filebase + TEST_GRAPHML_EXT
-        graphfile = os.path.join(TESTS_DIR, filename)
+        graphfile = os.path.join(TESTS_DIR, filebase + TEST_GRAPHML_EXT)
         outputfile = os.path.join(TESTS_DIR, filebase + TEST_OUTPUT_EXT)
         if not os.path.isfile(graphfile) or not os.path.isfile(outputfile):
             continue
-        output = open(outputfile).read()
-        print('Test {}: '.format(filebase), end='')
-        try:
-            g = gencode.CodeGenerator(graphfile, generate_loop=True, allow_empty_trans=True)
-            g.generate_code(TMP_FILE)
-            result = subprocess.run([PYTHON_CMD, TMP_FILE],
-                                    capture_output=True,
-                                    text=True,
-                                    check=True)
-            if result.stdout != output:
-                raise Exception('failed: output mismatch, required="{}" output="{}"'.format(output, result.stdout))
-            print('OK')
-        except gencode.ConvertorError as e:
-            if output == 'HSMException\n':
-                print('OK')
-                continue
-            print('failed: {}\n\n Program:{}\n'.format(e, TMP_FILE))
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print('Script failed: {}\n\n Program:{}\n'.format(e.stderr, TMP_FILE))
-            sys.exit(1)
+        with open(outputfile) as f:
+            queue.append((filebase, graphfile, f.read()))
+    queue.reverse()
+    # the programs mostly wait for the timers, so the pool is not limited by the CPUs count
+    jobs = jobs or max(MIN_JOBS, os.cpu_count() or 1)
+    failed = []
+    running = {}
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmproot:
+        while queue or running:
+            while queue and len(running) < jobs:
+                filebase, graphfile, output = queue.pop()
+                tmpdir = os.path.join(tmproot, filebase)
+                os.mkdir(tmpdir)
+                reader, writer = context.Pipe(duplex=False)
+                p = context.Process(target=run_test,
+                                    args=(writer, graphfile, output, tmpdir, dict(options)))
+                p.start()
+                writer.close()
+                running[reader] = (filebase, p, tmpdir, time.monotonic())
+            for reader in multiprocessing.connection.wait(list(running.keys()), timeout=0.1):
+                filebase, p, tmpdir, _ = running.pop(reader)
+                try:
+                    result = reader.recv()
+                except EOFError:
+                    result = None
+                p.join()
+                if result is None:
+                    result = {'error': 'failed: the test process exited with code {}'.format(p.exitcode)}
+                reader.close()
+                if not report(filebase, result, tmpdir, verbose):
+                    failed.append(filebase)
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            for reader, (filebase, p, tmpdir, started) in list(running.items()):
+                if time.monotonic() - started > TEST_TIMEOUT:
+                    p.kill()
+                    p.join()
+                    reader.close()
+                    del running[reader]
+                    print('Test {}: failed: timeout {} s\n'.format(filebase, TEST_TIMEOUT))
+                    failed.append(filebase)
+    print('{} tests failed: {}'.format(len(failed), ', '.join(sorted(failed))) if failed else 'All tests passed',
+          '({:.2f} s)'.format(time.perf_counter() - start))
+    return not failed
+
+def usage():
+    print('Usage: python3 {} [-v] [-O] [-t] [-s] [-j<jobs>]'.format(sys.argv[0]))
+    sys.exit(1)
 
 if __name__ == '__main__':
-    verbose = len(sys.argv) > 1 and sys.argv[1] == '-v'
+    args = sys.argv[1:]
+    verbose = '-v' in args
+    optimize = '-O' in args
+    typed = '-t' in args
+    # run the programs by the separate interpreter in the real time
+    isolated = '-s' in args
+    jobs = None
+    for arg in args:
+        if arg.startswith('-j'):
+            if not arg[2:].isdecimal() or int(arg[2:]) < 1:
+                usage()
+            jobs = int(arg[2:])
     tests = get_tests()
-    run_tests(tests, verbose)
-    sys.exit(0)
+    sys.exit(0 if run_tests(tests, verbose, optimize, typed, isolated, jobs) else 1)
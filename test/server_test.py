@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# -----------------------------------------------------------------------------
+# The HSM-to-Python generator server test
+#
+# Copyright (C) 2023-2025      Alexey Fedoseev <aleksey@fedoseev.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see https://www.gnu.org/licenses/
+# -----------------------------------------------------------------------------
+
+import sys
+import os
+import io
+import json
+import socket
+import tempfile
+import threading
+
+sys.path.append('..')
+
+import gencode
+import server
+
+TESTS_DIR = 'graphs'
+TEST_GRAPHML_EXT = '.graphml'
+SILENT_CLIENT_TIMEOUT = 0.5
+OPTIONS = {'generate_loop': True, 'allow_empty_trans': True}
+
+def generate(graphfile):
+    g = gencode.DocumentGenerator(graphfile, **OPTIONS)
+    if g.is_package():
+        return g.generate_files()
+    f = io.StringIO()
+    g.generate_code(f)
+    return f.getvalue()
+
+def served(response):
+    if response['status'] != 'ok':
+        return 'error: {}'.format(response['diagnostics'])
+    return response['files'] if 'files' in response else response['code']
+
+def run_tests(verbose=False):
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        socket_path = os.path.join(tmpdir, 'hsm.sock')
+        server.GeneratorRequestHandler.timeout = SILENT_CLIENT_TIMEOUT
+        with server.GeneratorServer(socket_path) as s:
+            thread = threading.Thread(target=s.serve_forever)
+            thread.start()
+            try:
+                for filename in sorted(os.listdir(TESTS_DIR)):
+                    if not filename.endswith(TEST_GRAPHML_EXT):
+                        continue
+                    graphfile = os.path.abspath(os.path.join(TESTS_DIR, filename))
+                    print('Test {}: '.format(filename), end='')
+                    try:
+                        code = generate(graphfile)
+                    except gencode.ConvertorError:
+                        code = None
+                    first = server.request(graphfile, OPTIONS, socket_path)
+                    second = server.request(graphfile, OPTIONS, socket_path)
+                    if code is None and first['status'] == 'error':
+                        print('OK (error)')
+                    elif served(first) != code or served(second) != code:
+                        print('failed: the server output mismatch')
+                        if verbose:
+                            print('direct:\n{}\nserved:\n{}\n'.format(code, served(first)))
+                        failed = True
+                    elif not second['cached']:
+                        print('failed: the document is not cached')
+                        failed = True
+                    else:
+                        print('OK')
+                response = server.request(os.path.join(TESTS_DIR, 'missing' + TEST_GRAPHML_EXT), OPTIONS, socket_path)
+                print('Test missing graph: ', end='')
+                if response['status'] == 'error' and response['error'] == 'request':
+                    print('OK')
+                else:
+                    print('failed: {}'.format(response))
+                    failed = True
+                print('Test relative graph path: ', end='')
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(socket_path)
+                    client.sendall(json.dumps({'graph': os.path.join(TESTS_DIR, 'timers' + TEST_GRAPHML_EXT)}).encode('utf-8') + b'\n')
+                    response = json.loads(client.makefile('rb').readline())
+                if response['status'] == 'error' and response['error'] == 'request':
+                    print('OK')
+                else:
+                    print('failed: {}'.format(response))
+                    failed = True
+                print('Test silent client: ', end='')
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+                    silent.connect(socket_path)
+                    response = server.request(os.path.join(TESTS_DIR, 'timers' + TEST_GRAPHML_EXT), OPTIONS, socket_path)
+                    error = json.loads(silent.makefile('rb').readline())
+                if response['status'] == 'ok' and error['error'] == 'request':
+                    print('OK')
+                else:
+                    print('failed: {} {}'.format(response, error))
+                    failed = True
+            finally:
+                s.shutdown()
+                thread.join()
+    return not failed
+
+if __name__ == '__main__':
+    verbose = len(sys.argv) > 1 and sys.argv[1] == '-v'
+    sys.exit(0 if run_tests(verbose) else 1)